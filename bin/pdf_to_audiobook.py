@@ -3,18 +3,52 @@
 #!/usr/bin/env python3
 
 
+import hashlib
 import os
+import re
 import sys
 import subprocess
 import json
+import queue
+import tempfile
+import threading
 import requests
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- Configuration ---
 PRIMARY_SERVER = "192.168.20.9:8880"
 FALLBACK_SERVER = "localhost:8880"
 GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+WRITE_BUFFER_SIZE = 1024 * 1024
+TTS_CHUNK_CHARS = 2000
+TTS_WORKERS = 4
+CACHE_DIR = Path.home() / ".cache" / "pdf_to_audiobook"
+# Gemini 2.5 Flash accepts ~1M input tokens but only writes 65,536 output tokens,
+# and the script is about as long as the text it is made from. Larger inputs are
+# split on page boundaries so each part's script fits in one response.
+GEMINI_CHUNK_TOKENS = 50_000
+GEMINI_CHARS_PER_TOKEN = 4
+GEMINI_WORKERS = 4
+GEMINI_PROMPT_INSTRUCTIONS = (
+    "Please take the following OCR from a pdf, and format it to be like a script for an audiobook. "
+    "Do not keep in any content that would not be spoken in an audiobook, but keep ALL the narration. "
+    "Do not output anything except for the script. Only output the words that should be said. "
+    "No speaker differences (\"Narrator:\", etc.). Only the words that should be read. "
+    "Include the title and headings, but don't include the publishing info at the beggining. "
+    "You may put publishing information in a readable format at the end of the script. "
+)
+GEMINI_PROMPT_SEPARATOR = "\n\n---\n"
+
+# Shared session so connections (and TLS) are reused across API calls.
+_HTTP = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.5))
+_HTTP.mount("http://", _adapter)
+_HTTP.mount("https://", _adapter)
 
 def select_language():
     """Prompts the user to select a language until a valid choice is made."""
@@ -27,50 +61,90 @@ def get_voice(language):
     """Returns the voice based on the selected language."""
     return "ef_dora" if language == "es" else "af_heart"
 
-def convert_pdf_to_text(pdf_path, txt_path):
-    """Converts a PDF file to a text file using pdftotext."""
+def convert_pdf_to_text(pdf_path):
+    """Extracts the text of a PDF with pdfium. Pages are separated by form feeds, like pdftotext."""
     print("Converting PDF to text...")
     try:
-        subprocess.run(["pdftotext", pdf_path, txt_path], check=True)
-        print(f"Raw text saved to '{txt_path}'")
-        return True
-    except FileNotFoundError:
-        print("Error: 'pdftotext' could not be found. Please install poppler-utils.")
-        return False
-    except subprocess.CalledProcessError:
-        print(f"Error: pdftotext failed to convert '{pdf_path}'.")
-        return False
-
-def format_text_with_gemini(raw_text_path):
-    """Formats text using the Gemini API."""
-    if not GEMINI_API_KEY:
-        print("Error: GEMINI_API_KEY environment variable is not set.")
+        import pypdfium2 as pdfium
+    except ImportError:
+        print("Error: 'pypdfium2' could not be found. Please install it with 'pip install pypdfium2'.")
         return None
-
-    print("Formatting text with Gemini 2.5 Flash...")
     try:
-        with open(raw_text_path, 'r', encoding='utf-8') as f:
-            raw_text_content = f.read()
-    except FileNotFoundError:
-        print(f"Error: Raw text file not found at '{raw_text_path}'")
+        pdf = pdfium.PdfDocument(pdf_path)
+    except pdfium.PdfiumError as e:
+        print(f"Error: pdfium failed to open '{pdf_path}': {e}")
         return None
+    try:
+        return "\f".join(page.get_textpage().get_text_range() for page in pdf).replace("\r\n", "\n")
+    finally:
+        pdf.close()
+
+def write_cache(cache_path, content):
+    """Atomically writes content to cache_path. A failed write is only a warning."""
+    tmp_path = None
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename it so a partial script is never cached.
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=CACHE_DIR, suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            f.write(content)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: Could not cache the Gemini script at '{cache_path}': {e}")
+        if tmp_path:
+            Path(tmp_path).unlink(missing_ok=True)
 
-    prompt = (
-        "Please take the following OCR from a pdf, and format it to be like a script for an audiobook. "
-        "Do not keep in any content that would not be spoken in an audiobook, but keep ALL the narration. "
-        "Do not output anything except for the script. Only output the words that should be said. "
-        "No speaker differences (\"Narrator:\", etc.). Only the words that should be read. "
-        "Include the title and headings, but don't include the publishing info at the beggining. "
-        "You may put publishing information in a readable format at the end of the script. "
-        f"\n\n---\n{raw_text_content}"
+def split_raw_text(raw_text_content, max_tokens=GEMINI_CHUNK_TOKENS):
+    """Splits extracted text into parts of about max_tokens, breaking only between pages."""
+    max_chars = max_tokens * GEMINI_CHARS_PER_TOKEN
+    parts = []
+    current = ""
+    for page in raw_text_content.split("\f"):
+        if current and len(current) + len(page) + 1 > max_chars:
+            parts.append(current)
+            current = page
+        else:
+            current = current + "\f" + page if current else page
+    if current:
+        parts.append(current)
+    return parts
+
+def gemini_part_note(index, total):
+    """Returns extra instructions for part index (0-based) of a book split into total parts."""
+    if total == 1:
+        return ""
+    if index == 0:
+        return (
+            f"This text is part 1 of {total} of a longer book. Start the script with the title, "
+            "but do not add any closing or publishing information at the end; the script continues in the next part. "
+        )
+    if index == total - 1:
+        return (
+            f"This text is the final part ({total} of {total}) of a longer book. Continue the script from where "
+            "the previous part left off; do not repeat the title or add an introduction. "
+        )
+    return (
+        f"This text is part {index + 1} of {total} of a longer book. Continue the script from where the "
+        "previous part left off; do not add a title, an introduction, or any closing or publishing information. "
     )
 
+def build_gemini_prompts(raw_text_content):
+    """Splits the text into parts and returns a (prompt prefix, text) pair for each."""
+    parts = split_raw_text(raw_text_content) or [raw_text_content]
+    return [
+        (GEMINI_PROMPT_INSTRUCTIONS + gemini_part_note(i, len(parts)) + GEMINI_PROMPT_SEPARATOR, part)
+        for i, part in enumerate(parts)
+    ]
+
+def request_gemini_script(prompt_prefix, raw_text_content):
+    """Sends one piece of text to the Gemini API and returns the script, or None on failure."""
+    prompt = prompt_prefix + raw_text_content
     payload = {"contents": [{"parts": [{"text": prompt}]}]}
     headers = {"Content-Type": "application/json"}
     url = f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=300)
+        response = _HTTP.post(url, headers=headers, json=payload, timeout=300)
         response.raise_for_status()
         data = response.json()
         processed_script = data['candidates'][0]['content']['parts'][0]['text']
@@ -86,118 +160,319 @@ def format_text_with_gemini(raw_text_path):
         print("Response:", response.text)
         return None
 
+def gemini_cache_path(prompts):
+    """Returns the cache file for the script made from the given (prefix, text) prompts.
 
-def generate_audiobook(script_content, voice, output_path):
-    """Generates the audiobook using the TTS engine."""
-    print(f"Generating audiobook (voice: {voice})...")
+    Keyed on the exact prompts sent (instructions, part notes and how the text
+    was split), so changing any of them invalidates old scripts. Prefix and
+    text are hashed separately to avoid building a copy of a multi-MB prompt.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    for prompt_prefix, part in prompts:
+        hasher.update(prompt_prefix.encode('utf-8'))
+        hasher.update(part.encode('utf-8'))
+    return CACHE_DIR / f"{hasher.hexdigest()}.script.txt"
+
+def read_cache(cache_path):
+    """Returns the cached script at cache_path, or None if there is none."""
+    if not cache_path.exists():
+        return None
+    with open(cache_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def format_part_with_gemini(prompt):
+    """Formats one (prefix, text) prompt, caching each part so a rerun only resends failed parts."""
+    cache_path = gemini_cache_path([prompt])
+    script = read_cache(cache_path)
+    if script is None:
+        script = request_gemini_script(*prompt)
+        if script:
+            write_cache(cache_path, script)
+    return script
+
+def format_text_with_gemini(raw_text_content):
+    """Formats text using the Gemini API, reusing a cached script for identical input.
+
+    Text too long for one response is split into parts that are formatted
+    concurrently and joined back together in order.
+    """
+    prompts = build_gemini_prompts(raw_text_content)
+    cache_path = gemini_cache_path(prompts)
+    cached_script = read_cache(cache_path)
+    if cached_script is not None:
+        print(f"Using cached Gemini script from '{cache_path}'")
+        return cached_script
+
+    if not GEMINI_API_KEY:
+        print("Error: GEMINI_API_KEY environment variable is not set.")
+        return None
+
+    print(f"Formatting text with Gemini 2.5 Flash ({len(prompts)} part(s))...")
+    with ThreadPoolExecutor(max_workers=GEMINI_WORKERS) as pool:
+        scripts = list(pool.map(format_part_with_gemini, prompts))
+    if not all(scripts):
+        failed = sum(1 for script in scripts if not script)
+        print(f"Error: {failed} of {len(scripts)} part(s) failed; finished parts are cached for the next run.")
+        return None
+
+    if len(scripts) == 1:
+        # A single part shares its cache file with the whole book.
+        return scripts[0]
+    processed_script = "\n\n".join(scripts)
+    write_cache(cache_path, processed_script)
+    return processed_script
+
+
+def split_script(script_content, max_chars=TTS_CHUNK_CHARS):
+    """Splits a script into chunks of about max_chars, breaking between paragraphs or sentences."""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", script_content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > max_chars:
+            pieces = re.split(r"(?<=[.!?])\s+", paragraph)
+        else:
+            pieces = [paragraph]
+        separator = "\n\n"
+        for piece in pieces:
+            if current and len(current) + len(separator) + len(piece) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = current + separator + piece if current else piece
+            separator = " "
+    if current:
+        chunks.append(current)
+    return chunks
+
+def check_tts_server(server):
+    """Returns True if the TTS server answers a cheap request quickly."""
+    try:
+        response = _HTTP.get(f"http://{server}/v1/models", timeout=5)
+        response.raise_for_status()
+        return True
+    except requests.exceptions.RequestException:
+        return False
+
+def order_tts_servers():
+    """Probes both TTS servers at once and returns the reachable ones, primary first.
+
+    A dead server is skipped entirely instead of costing a request timeout per
+    chunk. If neither answers, both are returned so synthesis still gets a try.
+    """
+    servers = [PRIMARY_SERVER, FALLBACK_SERVER]
+    with ThreadPoolExecutor(max_workers=len(servers)) as pool:
+        reachable = dict(zip(servers, pool.map(check_tts_server, servers)))
+    print(f"--> TTS servers reachable: {', '.join(s for s in servers if reachable[s]) or 'none'}")
+    return [server for server in servers if reachable[server]] or servers
+
+def synthesize_chunk(text, voice, output_path, servers):
+    """Synthesizes one piece of text to an MP3, trying each server in order."""
     payload = {
-        "input": script_content,
+        "input": text,
         "model": "kokoro",
         "voice": voice,
         "response_format": "mp3"
     }
     headers = {"Content-Type": "application/json"}
 
-    # Attempt primary server
-    print(f"--> Attempting primary server: {PRIMARY_SERVER}")
+    for server in servers:
+        try:
+            response = _HTTP.post(
+                f"http://{server}/v1/audio/speech",
+                headers=headers,
+                json=payload,
+                stream=True,
+                # Fail fast on a server that is down, but allow long syntheses.
+                timeout=(5, 600)
+            )
+            response.raise_for_status()
+            # iter_content wraps mid-stream urllib3 errors as RequestExceptions.
+            with open(output_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                for chunk in response.iter_content(chunk_size=WRITE_BUFFER_SIZE):
+                    f.write(chunk)
+            return True
+        except requests.exceptions.RequestException as e:
+            print(f"--> Server {server} failed for '{Path(output_path).name}': {e}")
+            # Don't leave a truncated file behind for the next server or the concat step.
+            Path(output_path).unlink(missing_ok=True)
+    return False
+
+def concat_audio(part_paths, output_path):
+    """Joins MP3 files into one with ffmpeg's concat demuxer, without re-encoding."""
+    list_path = part_paths[0].parent / "parts.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in part_paths:
+            f.write(f"file '{path}'\n")
     try:
-        response = requests.post(
-            f"http://{PRIMARY_SERVER}/v1/audio/speech",
-            headers=headers,
-            json=payload,
-            stream=True,
-            timeout=600
+        subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0",
+             "-i", str(list_path), "-c", "copy", str(output_path)],
+            check=True
         )
-        response.raise_for_status()
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"Successfully generated audiobook: {output_path}")
         return True
-    except requests.exceptions.RequestException as e:
-        print(f"--> Primary server failed: {e}")
+    except FileNotFoundError:
+        print("Error: 'ffmpeg' could not be found. Please install ffmpeg.")
+        return False
+    except subprocess.CalledProcessError:
+        print(f"Error: ffmpeg failed to join the audio chunks into '{output_path}'.")
+        return False
 
-    # Attempt fallback server
-    print(f"--> Attempting fallback server: {FALLBACK_SERVER}")
+def generate_audiobook(script_content, voice, output_path, servers=(PRIMARY_SERVER, FALLBACK_SERVER)):
+    """Generates the audiobook using the TTS engine, synthesizing chunks in parallel."""
+    print(f"Generating audiobook (voice: {voice})...")
+    chunks = split_script(script_content)
+    print(f"--> Synthesizing {len(chunks)} chunk(s) on {servers[0]}")
+
+    if len(chunks) <= 1:
+        if not synthesize_chunk(script_content, voice, output_path, servers):
+            print("Error: Audiobook generation failed on both primary and fallback servers.")
+            return False
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            part_paths = [Path(tmp_dir) / f"part_{i:05d}.mp3" for i in range(len(chunks))]
+            with ThreadPoolExecutor(max_workers=TTS_WORKERS) as pool:
+                results = list(pool.map(synthesize_chunk, chunks, [voice] * len(chunks), part_paths, [servers] * len(chunks)))
+            if not all(results):
+                print("Error: Audiobook generation failed on both primary and fallback servers.")
+                return False
+            if not concat_audio(part_paths, output_path):
+                return False
+    print(f"Successfully generated audiobook: {output_path}")
+    return True
+
+def extract_stage(job):
+    """Pipeline stage 1: gets the raw text of a PDF, or the script of a TXT file."""
+    input_file = job["input_file"]
+    if job["extension"] == '.pdf':
+        print(f"Processing PDF file: {input_file}")
+        job["raw_text"] = convert_pdf_to_text(job["path"])
+        return job["raw_text"] is not None
+
+    print(f"Processing text file directly: {input_file}")
     try:
-        response = requests.post(
-            f"http://{FALLBACK_SERVER}/v1/audio/speech",
-            headers=headers,
-            json=payload,
-            stream=True,
-            timeout=600
-        )
-        response.raise_for_status()
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"Successfully generated audiobook: {output_path}")
+        with open(job["path"], 'r', encoding='utf-8') as f:
+            job["script"] = f.read()
         return True
-    except requests.exceptions.RequestException as e:
-        print(f"--> Fallback server failed: {e}")
-        print("Error: Audiobook generation failed on both primary and fallback servers.")
+    except FileNotFoundError:
+        print(f"Error: Could not read text file at '{input_file}'")
+        return False
+
+def format_stage(job):
+    """Pipeline stage 2: turns a PDF's raw text into an audiobook script with Gemini."""
+    if job["extension"] != '.pdf':
+        return True
+
+    processed_script = format_text_with_gemini(job["raw_text"])
+    if not processed_script:
+        return False
+
+    processed_txt_file = f"{job['basename']}.processed.txt"
+    with open(processed_txt_file, 'w', encoding='utf-8') as f:
+        f.write(processed_script)
+    print(f"Processed script saved to '{processed_txt_file}'")
+    job["script"] = processed_script
+    return True
+
+def synthesize_stage(job):
+    """Pipeline stage 3: synthesizes the script to an MP3."""
+    if not job["script"]:
+        print(f"Error: No script content available for TTS for '{job['input_file']}'.")
         return False
+    servers = job["tts_servers"].result()
+    job["done"] = generate_audiobook(job["script"], job["voice"], f"{job['basename']}.mp3", servers)
+    return job["done"]
+
+def run_stage(stage, in_queue, out_queue):
+    """Runs a pipeline stage on jobs from in_queue until it receives None."""
+    while True:
+        job = in_queue.get()
+        if job is None:
+            if out_queue is not None:
+                out_queue.put(None)
+            return
+        try:
+            ok = stage(job)
+        except Exception as e:
+            # Keep the pipeline draining so the other stages still see the sentinel.
+            print(f"Error: Unexpected failure while processing '{job['input_file']}': {e}")
+            ok = False
+        if ok and out_queue is not None:
+            out_queue.put(job)
 
 def main():
-    """Main function to orchestrate the audiobook generation process."""
+    """Main function to orchestrate the audiobook generation process.
+
+    Each input goes through extract -> format -> synthesize. The stages run in
+    their own threads connected by queues, so with several inputs the next PDF
+    is extracted and formatted while the previous one is being synthesized.
+    """
     parser = argparse.ArgumentParser(
-        description="Generate an audiobook from a PDF or TXT file.",
+        description="Generate audiobooks from PDF or TXT files.",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument("input_file", help="Path to the input .pdf or .txt file.")
-    parser.add_argument("language", nargs='?', choices=['en', 'es'], help="Language for the audiobook (en/es).")
+    parser.add_argument("input_files", nargs='+', help="Paths to the input .pdf or .txt files, optionally followed by the language (en/es).")
     args = parser.parse_args()
 
-    input_file = args.input_file
-    language = args.language
+    input_files = args.input_files
+    language = None
+    if len(input_files) > 1 and input_files[-1] in ['en', 'es'] and not Path(input_files[-1]).exists():
+        language = input_files.pop()
 
-    if not os.path.exists(input_file):
-        print(f"Error: Input file not found at '{input_file}'")
-        sys.exit(1)
+    # Resolve each path once; everything below works on the Path objects.
+    input_paths = []
+    for input_file in input_files:
+        path = Path(input_file).resolve()
+        if not path.is_file():
+            print(f"Error: Input file not found at '{input_file}'")
+            sys.exit(1)
 
-    file_extension = os.path.splitext(input_file)[1].lower()
-    if file_extension not in ['.pdf', '.txt']:
-        print(f"Error: Unsupported file type '{file_extension}'. Please provide a .pdf or .txt file.")
-        sys.exit(1)
+        if path.suffix.lower() not in ['.pdf', '.txt']:
+            print(f"Error: Unsupported file type '{path.suffix}'. Please provide a .pdf or .txt file.")
+            sys.exit(1)
+        input_paths.append((input_file, path))
 
     if not language:
         language = select_language()
 
     voice = get_voice(language)
-    basename = os.path.splitext(os.path.basename(input_file))[0]
-    output_file = f"{basename}.mp3"
-    script_for_tts = ""
+    # Find a working TTS server while the first input is still being extracted and formatted.
+    probe_pool = ThreadPoolExecutor(max_workers=1)
+    tts_servers = probe_pool.submit(order_tts_servers)
+    probe_pool.shutdown(wait=False)
+    jobs = []
+    for input_file, path in input_paths:
+        jobs.append({
+            "input_file": input_file,
+            "path": path,
+            "extension": path.suffix.lower(),
+            "basename": path.stem,
+            "raw_text": "",
+            "voice": voice,
+            "tts_servers": tts_servers,
+            "script": "",
+            "done": False,
+        })
 
-    if file_extension == '.pdf':
-        print(f"Processing PDF file: {input_file}")
-        raw_txt_file = f"{basename}.raw.txt"
-        processed_txt_file = f"{basename}.processed.txt"
+    extract_queue, format_queue, synthesize_queue = queue.Queue(), queue.Queue(), queue.Queue()
+    workers = [
+        threading.Thread(target=run_stage, args=(extract_stage, extract_queue, format_queue)),
+        threading.Thread(target=run_stage, args=(format_stage, format_queue, synthesize_queue)),
+        threading.Thread(target=run_stage, args=(synthesize_stage, synthesize_queue, None)),
+    ]
+    for worker in workers:
+        worker.start()
+    for job in jobs:
+        extract_queue.put(job)
+    extract_queue.put(None)
+    for worker in workers:
+        worker.join()
 
-        if not convert_pdf_to_text(input_file, raw_txt_file):
-            sys.exit(1)
-
-        processed_script = format_text_with_gemini(raw_txt_file)
-        if not processed_script:
-            sys.exit(1)
-
-        with open(processed_txt_file, 'w', encoding='utf-8') as f:
-            f.write(processed_script)
-        print(f"Processed script saved to '{processed_txt_file}'")
-        script_for_tts = processed_script
-
-    elif file_extension == '.txt':
-        print(f"Processing text file directly: {input_file}")
-        try:
-            with open(input_file, 'r', encoding='utf-8') as f:
-                script_for_tts = f.read()
-        except FileNotFoundError:
-            print(f"Error: Could not read text file at '{input_file}'")
-            sys.exit(1)
-
-    if script_for_tts:
-        generate_audiobook(script_for_tts, voice, output_file)
-    else:
-        print("Error: No script content available for TTS.")
+    failed = [job["input_file"] for job in jobs if not job["done"]]
+    if failed:
+        print(f"Error: Failed to generate audiobooks for: {', '.join(failed)}")
         sys.exit(1)
 
 if __name__ == "__main__":
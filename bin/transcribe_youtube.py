@@ -1,11 +1,109 @@
 #!/usr/bin/env python3
 
+import argparse
+import importlib.util
+import os
+import platform
+import shutil
 import subprocess
-import whisper
-from whisper.utils import WriteSRT
+import sys
+import tempfile
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from yt_dlp import YoutubeDL
 
-print("""
+# VRAM below which GPU weights are kept in int8 instead of float16.
+LOW_VRAM_BYTES = 8 * 1024**3
+# Number of VAD-split (<= 30 s) speech chunks sent through the encoder at once.
+BATCH_SIZE = 16
+# Silero VAD settings. Only regions with speech are sent to Whisper, so intros,
+# outros and music breaks cost nothing; timestamps are mapped back to the
+# original audio by faster-whisper. 160 ms is the batched pipeline's default
+# silence gap; padding is kept small so little non-speech audio gets through.
+VAD_PARAMETERS = {"min_silence_duration_ms": 160, "speech_pad_ms": 200}
+# Whisper expects 16 kHz mono float32 samples.
+SAMPLE_RATE = 16000
+# Videos fetched at once when several URLs are given; downloading is I/O bound.
+# This also caps how many decoded videos (~230 MB per hour) wait in memory.
+DOWNLOAD_WORKERS = 4
+# yt-dlp options; "best" covers videos with no audio-only format (ffmpeg drops the video).
+YDL_OPTIONS = {"format": "bestaudio/best", "quiet": True, "no_warnings": True, "noprogress": True}
+# Characters that are not allowed in filenames, mapped to underscores.
+_FNAME_TBL = str.maketrans({c: "_" for c in '/\\:*?"<>|'})
+# Where the OpenVINO backend keeps its exported model and compiled blobs.
+OPENVINO_CACHE_DIR = Path.home() / ".cache" / "ov_whisper"
+BACKENDS = ["auto", "faster", "coreml", "openvino"]
+
+# A transcribed piece of audio, with times in seconds.
+Segment = namedtuple("Segment", ["start", "end", "text"])
+
+
+def select_device_and_compute_type():
+    """Picks the device and weight precision for the Whisper model.
+
+    - No CUDA GPU:          cpu,  int8          (int8 GEMM kernels, 4x less weight traffic than fp32)
+    - CUDA GPU, < 8 GB:     cuda, int8_float16  (int8 weights, fp16 activations)
+    - CUDA GPU, >= 8 GB:    cuda, float16
+    """
+    try:
+        import torch
+    except ImportError:
+        import ctranslate2
+
+        if ctranslate2.get_cuda_device_count() == 0:
+            return "cpu", "int8"
+        # Without torch there is no cheap way to ask for VRAM, so stay on the safe side.
+        return "cuda", "int8_float16"
+
+    if not torch.cuda.is_available():
+        return "cpu", "int8"
+    _, total_vram = torch.cuda.mem_get_info()
+    if total_vram < LOW_VRAM_BYTES:
+        return "cuda", "int8_float16"
+    return "cuda", "float16"
+
+
+def supports_flash_attention(device, compute_type):
+    """Whether CTranslate2 can run the model with Flash Attention 2.
+
+    It needs a float16 model on an Ampere (compute capability 8.0) or newer GPU.
+    """
+    if device != "cuda" or compute_type != "float16":
+        return False
+    import ctranslate2
+
+    # bfloat16 support in CTranslate2 has the same Ampere+ requirement.
+    return "bfloat16" in ctranslate2.get_supported_compute_types("cuda")
+
+
+def format_timestamp(seconds):
+    """Formats seconds as an SRT timestamp (HH:MM:SS,mmm)."""
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def format_srt_entry(index, segment):
+    """Formats one segment as an SRT entry, echoing it as progress."""
+    start = format_timestamp(segment.start)
+    end = format_timestamp(segment.end)
+    text = segment.text.strip()
+    print(f"[{start} --> {end}] {text}")
+    return f"{index}\n{start} --> {end}\n{text}\n\n"
+
+
+def format_srt(segments):
+    """Formats all segments as the contents of an SRT file."""
+    return "".join(format_srt_entry(i, seg) for i, seg in enumerate(segments, 1))
+
+
+def print_banner():
+    """Prints the welcome banner."""
+    print("""
  _  __               _ _       _____                              _ _               
 | |/ /__ _ _ __ ___ (_| )___  |_   _| __ __ _ _ __  ___  ___ _ __(_) |__   ___ _ __ 
  | ' // _` | '_ ` _ \| |// __|   | || '__/ _` | '_ \/ __|/ __| '__| | '_ \ / _ \ '__|
@@ -13,67 +111,407 @@ print("""
  |_|\_\__,_|_| |_| |_|_| |___/   |_||_|  \__,_|_| |_|___/\___|_|  |_|_.__/ \___|_|   
                                                                                       
 """)
-print("Welcome to Kami's Transcriber!")
-print("This tool will download the audio from a YouTube video and create subtitles.")
-print()
-
-# Define and create the output directory
-output_dir = Path.home() / "Desktop"
-output_dir.mkdir(parents=True, exist_ok=True)
-
-
-# Prompt for URL
-url = input("Step 1: Paste the YouTube URL here: ")
-
-# Get video title
-print()
-print("Getting video title...")
-title = subprocess.run(
-    ["yt-dlp", "--print", "%(title)s", url], capture_output=True, text=True
-).stdout.strip()
-# Sanitize title for filename
-safe_title = (
-    title.replace("/", "_")
-    .replace("\\", "_")
-    .replace(":", "_")
-    .replace("*", "_")
-    .replace("?", "_")
-    .replace('"', "_")
-    .replace("<", "_")
-    .replace(">", "_")
-    .replace("|", "_")
-)
-audio_file = output_dir / (safe_title + ".mp3")
-srt_file = output_dir / (safe_title + ".srt")
-print(f"Video title: {title}")
-
-# Download audio
-print()
-print("Step 2: Downloading audio from the video... (this may take a minute)")
-subprocess.run(
-    ["yt-dlp", "-x", "--audio-format", "mp3", "-o", str(audio_file), url], check=True
-)
-print("Audio downloaded successfully!")
-
-# Transcribe with Whisper
-print()
-print("Step 3: Loading the Whisper AI model...")
-model = whisper.load_model("small")
-print("Model loaded. Now transcribing the audio... (this may take several minutes)")
-print("You will see progress below as words and timestamps appear:")
-result = model.transcribe(str(audio_file), verbose=True)
-print("Transcription finished!")
-
-# Save SRT
-print()
-print("Step 4: Saving the subtitles file...")
-writer = WriteSRT(str(output_dir))
-with open(srt_file, "w", encoding="utf-8") as f:
-    writer.write_result(result, f)
-print(f"Subtitles saved to your Desktop as {srt_file.name}")
-
-# Inform user
-print()
-print("🎉 All done! Your SRT file is ready.")
-print(f'You can find it as "{srt_file.name}" on your Desktop.')
-input("Press Enter to close the program.")
+    print("Welcome to Kami's Transcriber!")
+    print("This tool will download the audio from a YouTube video and create subtitles.")
+    print()
+
+
+def get_video_info(url):
+    """Returns yt-dlp's metadata for the video, including its best audio stream."""
+    with YoutubeDL(YDL_OPTIONS) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def sanitize_title(title):
+    """Makes a video title safe to use as a filename."""
+    return title.translate(_FNAME_TBL)
+
+
+def download_audio(info, audio_file=None):
+    """Downloads the audio track of the video and decodes it to 16 kHz mono float32.
+
+    yt-dlp fetches the original audio stream (with its retries, cookies and
+    fragment handling) into a temporary file, and ffmpeg decodes that straight
+    into the format Whisper consumes; no intermediate MP3 is encoded. If
+    audio_file is given, ffmpeg also encodes an MP3 copy there from the same
+    decode.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        options = dict(YDL_OPTIONS, outtmpl=str(Path(tmp_dir) / "audio.%(ext)s"))
+        with YoutubeDL(options) as ydl:
+            # Reuses the already extracted info instead of querying the site again.
+            result = ydl.process_ie_result(info, download=True)
+        source = result["requested_downloads"][0]["filepath"]
+        ffmpeg_cmd = [
+            "ffmpeg", "-loglevel", "error", "-nostdin", "-i", source,
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "pipe:1",
+        ]
+        if audio_file is not None:
+            ffmpeg_cmd += ["-y", "-vn", str(audio_file)]
+        result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def fetch(url, output_dir, keep_audio):
+    """Downloads one video's audio. Returns (title, srt_file, audio)."""
+    info = get_video_info(url)
+    if info.get("_type") == "playlist":
+        raise ValueError("playlist and channel URLs are not supported")
+    safe_title = sanitize_title(info["title"])
+    audio_file = output_dir / (safe_title + ".mp3") if keep_audio else None
+    srt_file = output_dir / (safe_title + ".srt")
+    return info["title"], srt_file, download_audio(info, audio_file)
+
+
+def has_cuda_gpu():
+    """Whether CTranslate2 is installed and can see a CUDA GPU."""
+    try:
+        import ctranslate2
+    except ImportError:
+        return False
+    return ctranslate2.get_cuda_device_count() > 0
+
+
+def select_backend():
+    """Picks the fastest installed backend for this machine.
+
+    - Apple Silicon with pywhispercpp installed: whisper.cpp, which runs the
+      encoder on the Neural Engine when built with CoreML support.
+    - No CUDA GPU and optimum-intel installed: OpenVINO, on the best Intel
+      device available (see select_openvino_device).
+    - Everything else: faster-whisper.
+    """
+    if (
+        sys.platform == "darwin"
+        and platform.machine() == "arm64"
+        and importlib.util.find_spec("pywhispercpp") is not None
+    ):
+        return "coreml"
+    if (
+        importlib.util.find_spec("optimum") is not None
+        and importlib.util.find_spec("optimum.intel") is not None
+        and not has_cuda_gpu()
+    ):
+        return "openvino"
+    return "faster"
+
+
+def select_openvino_device():
+    """Returns the preferred OpenVINO device: NPU, then GPU, then CPU."""
+    import openvino
+
+    available = openvino.Core().available_devices
+    for kind in ("NPU", "GPU"):
+        for device in available:
+            # Devices are listed as e.g. "GPU" or "GPU.0" when there are several.
+            if device.split(".")[0] == kind:
+                return device
+    return "CPU"
+
+
+def load_faster_whisper():
+    """Loads faster-whisper (CTranslate2) wrapped in a batched inference pipeline.
+
+    On GPU the model is also warmed up with one window of silence, so CUDA
+    kernel loading and memory allocation happen here (usually overlapped with
+    the download) instead of on the first real transcription.
+    """
+    from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+    device, compute_type = select_device_and_compute_type()
+
+    def build(flash_attention):
+        model = WhisperModel(
+            "small",
+            device=device,
+            compute_type=compute_type,
+            flash_attention=flash_attention,
+        )
+        if device == "cuda":
+            # Runs the encoder and one decoder step on a full 30 s window.
+            model.detect_language(np.zeros(30 * SAMPLE_RATE, dtype=np.float32))
+        return model
+
+    flash_attention = supports_flash_attention(device, compute_type)
+    try:
+        model = build(flash_attention)
+    except (RuntimeError, ValueError, TypeError) as e:
+        # CTranslate2 builds without Flash Attention (or older faster-whisper
+        # releases without the option) fail here; use the regular kernels instead.
+        if not flash_attention:
+            raise
+        print(f"Flash Attention unavailable ({e}); using standard attention.")
+        model = build(False)
+    pipeline = BatchedInferencePipeline(model)
+
+    def transcribe(audio):
+        # The batched pipeline drops non-speech with VAD, splits the speech into
+        # <= 30 s chunks and decodes BATCH_SIZE of them in parallel. Segments come
+        # back as a lazy generator and are printed as each batch is decoded.
+        segments, info = pipeline.transcribe(
+            audio,
+            vad_filter=True,
+            vad_parameters=VAD_PARAMETERS,
+            batch_size=BATCH_SIZE,
+            # The batched pipeline defaults to text-only decoding, which yields one
+            # segment per (up to 30 s) VAD chunk; timestamp tokens give sentence-length cues.
+            without_timestamps=False,
+        )
+        return segments
+
+    return transcribe
+
+
+def load_whisper_cpp():
+    """Loads whisper.cpp through pywhispercpp.
+
+    For the Neural Engine, install pywhispercpp built with WHISPER_COREML=1 and
+    put the CoreML encoder (ggml-small-encoder.mlmodelc) next to the ggml model.
+    """
+    from pywhispercpp.model import Model
+
+    model = Model("small", print_realtime=False, print_progress=False)
+
+    def transcribe(audio):
+        # whisper.cpp reports times in units of 10 ms.
+        for segment in model.transcribe(audio):
+            yield Segment(segment.t0 / 100, segment.t1 / 100, segment.text)
+
+    return transcribe
+
+
+def load_openvino():
+    """Loads Whisper through OpenVINO on an Intel NPU, GPU or CPU.
+
+    The model is exported to OpenVINO IR once and compiled blobs are cached, so
+    only the first run pays the export and compile cost. If the model cannot be
+    compiled for the preferred device, it falls back to the CPU.
+    """
+    from optimum.intel import OVModelForSpeechSeq2Seq
+    from transformers import AutoProcessor, pipeline
+
+    model_id = "openai/whisper-small"
+    model_dir = OPENVINO_CACHE_DIR / "whisper-small"
+    ov_config = {"CACHE_DIR": str(OPENVINO_CACHE_DIR)}
+    if not model_dir.exists():
+        # Export into a temporary sibling and rename it into place, so an
+        # interrupted export never leaves a partial model_dir behind.
+        OPENVINO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=OPENVINO_CACHE_DIR, prefix="whisper-small.tmp")
+        try:
+            exported = OVModelForSpeechSeq2Seq.from_pretrained(
+                model_id, export=True, compile=False
+            )
+            exported.save_pretrained(tmp_dir)
+            AutoProcessor.from_pretrained(model_id).save_pretrained(tmp_dir)
+            try:
+                os.replace(tmp_dir, model_dir)
+            except OSError:
+                # Another run finished its export first; keep that one.
+                if not model_dir.exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    processor = AutoProcessor.from_pretrained(model_dir)
+
+    device = select_openvino_device()
+    try:
+        model = OVModelForSpeechSeq2Seq.from_pretrained(
+            model_dir, device=device, ov_config=ov_config
+        )
+    except RuntimeError as e:
+        if device == "CPU":
+            raise
+        print(f"OpenVINO could not compile Whisper for {device} ({e}); using CPU.")
+        device = "CPU"
+        model = OVModelForSpeechSeq2Seq.from_pretrained(
+            model_dir, device=device, ov_config=ov_config
+        )
+    print(f"Running Whisper with OpenVINO on {device}.")
+    asr = pipeline(
+        "automatic-speech-recognition",
+        model=model,
+        tokenizer=processor.tokenizer,
+        feature_extractor=processor.feature_extractor,
+        chunk_length_s=30,
+    )
+
+    def transcribe(audio):
+        result = asr({"raw": audio, "sampling_rate": SAMPLE_RATE}, return_timestamps=True)
+        for chunk in result["chunks"]:
+            start, end = chunk["timestamp"]
+            yield Segment(start, end if end is not None else start, chunk["text"])
+
+    return transcribe
+
+
+def load_model(backend="auto"):
+    """Loads a Whisper backend. Returns a function mapping audio to segments."""
+    if backend == "auto":
+        backend = select_backend()
+    if backend == "coreml":
+        return load_whisper_cpp()
+    if backend == "openvino":
+        return load_openvino()
+    return load_faster_whisper()
+
+
+def transcribe_audio(model, audio, srt_file):
+    """Transcribes 16 kHz mono float32 audio and writes the subtitles to srt_file."""
+    # Transcribe fully before opening the file, so a failure leaves no empty .srt behind.
+    subtitles = format_srt(model(audio))
+    with open(srt_file, "w", encoding="utf-8") as f:
+        f.write(subtitles)
+
+
+def serve(output_dir, keep_audio, backend):
+    """Transcribes every URL read from stdin, keeping one model loaded throughout."""
+    print("Loading the Whisper AI model...")
+    model = load_model(backend)
+    print("Model loaded. Reading YouTube URLs from stdin, one per line.")
+    for line in sys.stdin:
+        url = line.strip()
+        if not url:
+            continue
+        # One bad URL must not take the whole server down.
+        try:
+            title, srt_file, audio = fetch(url, output_dir, keep_audio)
+        except Exception as e:
+            print(f"Error: Failed to download audio for '{url}': {e}")
+            continue
+        print(f"Transcribing: {title}")
+        try:
+            transcribe_audio(model, audio, srt_file)
+        except Exception as e:
+            print(f"Error: Failed to transcribe '{title}': {e}")
+            continue
+        print(f"Subtitles saved as {srt_file}")
+
+
+def transcribe_batch(urls, output_dir, keep_audio, backend):
+    """Downloads videos concurrently and transcribes each as it arrives.
+
+    At most DOWNLOAD_WORKERS videos are downloading or waiting for the model at
+    any time; a new download starts only when a finished one is picked up.
+    """
+    pending = iter(urls)
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+
+        def submit_next():
+            url = next(pending, None)
+            if url is not None:
+                futures[pool.submit(fetch, url, output_dir, keep_audio)] = url
+
+        futures = {}
+        for _ in range(DOWNLOAD_WORKERS):
+            submit_next()
+        print(f"Downloading {len(urls)} videos. Loading the Whisper AI model...")
+        model = load_model(backend)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Drop the finished future so its audio is freed once transcribed.
+                url = futures.pop(future)
+                submit_next()
+                try:
+                    title, srt_file, audio = future.result()
+                except Exception as e:
+                    print(f"Error: Failed to download audio for '{url}': {e}")
+                    continue
+                print(f"Transcribing: {title}")
+                try:
+                    transcribe_audio(model, audio, srt_file)
+                except Exception as e:
+                    print(f"Error: Failed to transcribe '{title}': {e}")
+                    continue
+                print(f"Subtitles saved as {srt_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Download the audio from a YouTube video and create subtitles."
+    )
+    parser.add_argument(
+        "urls",
+        nargs="*",
+        help="YouTube URLs to transcribe. Also read from stdin, one per line, when piped.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the model loaded and transcribe URLs read from stdin, one per line.",
+    )
+    parser.add_argument(
+        "--keep-audio",
+        action="store_true",
+        help="Also save the downloaded audio as an MP3 next to the subtitles.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="auto",
+        help="Speech recognition backend: faster-whisper, whisper.cpp with CoreML, or OpenVINO.",
+    )
+    args = parser.parse_args()
+
+    # Define and create the output directory
+    output_dir = Path.home() / "Desktop"
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.serve:
+        serve(output_dir, args.keep_audio, args.backend)
+        return
+
+    urls = args.urls
+    if not urls and not sys.stdin.isatty():
+        urls = [line.strip() for line in sys.stdin if line.strip()]
+    if urls:
+        transcribe_batch(urls, output_dir, args.keep_audio, args.backend)
+        return
+
+    print_banner()
+
+    # Prompt for URL
+    url = input("Step 1: Paste the YouTube URL here: ")
+
+    # Get video title
+    print()
+    print("Getting video title...")
+    info = get_video_info(url)
+    title = info["title"]
+    safe_title = sanitize_title(title)
+    audio_file = output_dir / (safe_title + ".mp3") if args.keep_audio else None
+    srt_file = output_dir / (safe_title + ".srt")
+    print(f"Video title: {title}")
+
+    # Download audio while the Whisper model loads in the background
+    print()
+    print("Step 2: Downloading audio from the video... (this may take a minute)")
+    with ThreadPoolExecutor(max_workers=1) as loader:
+        model_future = loader.submit(load_model, args.backend)
+        audio = download_audio(info, audio_file)
+        print("Audio downloaded successfully!")
+
+        # Transcribe with Whisper
+        print()
+        print("Step 3: Loading the Whisper AI model...")
+        model = model_future.result()
+    print("Model loaded. Now transcribing the audio... (this may take several minutes)")
+    print("You will see progress below as words and timestamps appear:")
+    transcribe_audio(model, audio, srt_file)
+    print("Transcription finished!")
+
+    # Save SRT
+    print()
+    print("Step 4: Saving the subtitles file...")
+    print(f"Subtitles saved to your Desktop as {srt_file.name}")
+
+    # Inform user
+    print()
+    print("🎉 All done! Your SRT file is ready.")
+    print(f'You can find it as "{srt_file.name}" on your Desktop.')
+    input("Press Enter to close the program.")
+
+
+if __name__ == "__main__":
+    main()